@@ -1,16 +1,9 @@
 import streamlit as st
-import pandas as pd
 import modules.data_wrangling as dw
 from st_aggrid import GridOptionsBuilder, AgGrid
 
 
-dtype_map = {"Numeric": float, "Categorical": "category"}
-dtype_map_inverse = {
-    "float64": "Numeric",
-    "category": "Categorical",
-    "object": "Categorical",
-    "int64": "Numeric",
-}
+dtype_map = {"Numeric": float, "Categorical": "category", "Date": "datetime64[ns]"}
 
 
 st.set_page_config(page_title="Home page", layout="wide")
@@ -20,16 +13,18 @@ st.title("Data Upload page")
 user_file = st.file_uploader(
     label="You can upload the data here.", type=["csv", "xlsx"]
 )
-typelist = ("Numeric", "Categorical")
+typelist = ("Numeric", "Categorical", "Date")
 
 if user_file is not None:
-    try:
-        if "df" not in st.session_state:
-            st.session_state["df"] = pd.read_csv(user_file)
-    except Exception as e:
-        print(e)
-        if "df" not in st.session_state:
-            st.session_state["df"] = pd.read_excel(user_file)
+    # Only reparse when a new file is uploaded, so dropped columns and cast types survive reruns
+    if st.session_state.get("file_id") != user_file.file_id:
+        try:
+            st.session_state["df"] = dw.read_uploaded_file(
+                user_file.getvalue(), user_file.name
+            )
+            st.session_state["file_id"] = user_file.file_id
+        except Exception:
+            st.error("The uploaded file could not be read!")
 
 
 if "df" in st.session_state:
@@ -44,7 +39,7 @@ if "df" in st.session_state:
     if st.button("Drop selected columns"):
         st.session_state["df"] = st.session_state["df"].drop(cols_drop, axis=1)
 
-    original_types = dw.create_type_df(st.session_state["df"], dtype_map_inverse)
+    original_types = dw.create_type_df(st.session_state["df"])
     orig_dict = dw.create_type_dict(original_types)
 
     gb = GridOptionsBuilder.from_dataframe(original_types)
@@ -67,10 +62,12 @@ if "df" in st.session_state:
     )
 
     res_dict = dw.create_type_dict(response.data)
-    try:
-        df, orig_dict = dw.cast_dtype(
-            st.session_state["df"], orig_dict, res_dict, dtype_map
-        )
-    except Exception as e:
-        print(e)
-        st.write("Not a valid type!")
+    # Reruns triggered by other widgets leave the types untouched, skip the cast then
+    if res_dict != orig_dict:
+        try:
+            st.session_state["df"], orig_dict = dw.cast_dtype(
+                st.session_state["df"], orig_dict, res_dict, dtype_map
+            )
+        except Exception as e:
+            print(e)
+            st.write("Not a valid type!")
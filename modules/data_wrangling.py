@@ -1,23 +1,113 @@
+import io
+from joblib import parallel_backend
 import pandas as pd
+from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import (
     OneHotEncoder,
     OrdinalEncoder,
     TargetEncoder,
 )
 import numpy as np
+from pandas.api.types import (
+    is_datetime64_any_dtype,
+    is_float_dtype,
+    is_integer_dtype,
+    is_numeric_dtype,
+    is_object_dtype,
+)
+from scipy import sparse
 import streamlit as st
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
-from sklearn.pipeline import Pipeline
 import altair as alt
 
 
-def create_type_df(df: pd.DataFrame, dtype_map: dict) -> pd.DataFrame:
+def downcast_dtypes(df: pd.DataFrame, max_unique_ratio: float = 0.5) -> pd.DataFrame:
+    """Shrinks the memory footprint of freshly loaded data: numeric columns are downcast to the smallest
+    dtype that holds their values exactly and low-cardinality object columns are converted to category
+
+    Args:
+        df (pd.DataFrame): data
+        max_unique_ratio (float): object columns with a lower unique/row ratio than this become category
+
+    Returns:
+        pd.DataFrame: data with downcast dtypes
+    """
+    # Columns are accessed by position, the labels are not guaranteed to be unique
+    for i, dtype in enumerate(df.dtypes):
+        col = df.iloc[:, i]
+        if is_integer_dtype(dtype):
+            df.isetitem(i, pd.to_numeric(col, downcast="integer"))
+        elif is_float_dtype(dtype):
+            # Only downcast when float32 holds every value exactly, the data must not change
+            downcast = col.astype(np.float32)
+            if np.array_equal(
+                downcast.to_numpy(dtype=np.float64, na_value=np.nan),
+                col.to_numpy(dtype=np.float64, na_value=np.nan),
+                equal_nan=True,
+            ):
+                df.isetitem(i, downcast)
+        elif is_object_dtype(dtype) and len(df) > 0:
+            if col.nunique() / len(df) < max_unique_ratio:
+                df.isetitem(i, col.astype("category"))
+    return df
+
+
+@st.cache_data
+def read_uploaded_file(file_bytes: bytes, file_name: str) -> pd.DataFrame:
+    """Parses the uploaded csv or xlsx file. Cached on the file contents, so uploading the same file again is instant
+
+    Args:
+        file_bytes (bytes): raw content of the uploaded file
+        file_name (str): name of the uploaded file, its extension decides the parser
+
+    Returns:
+        pd.DataFrame: data with downcast dtypes
+    """
+    buffer = io.BytesIO(file_bytes)
+    if file_name.lower().endswith(".csv"):
+        try:
+            df = pd.read_csv(buffer, engine="pyarrow")
+        except pd.errors.ParserError:
+            # Ragged rows (missing or trailing fields) are only accepted by the C engine
+            df = None
+        # The pyarrow engine also keeps duplicate and blank headers as they are and parses
+        # timestamps, reparse with the C engine so the result matches it: a.1 / Unnamed: 1
+        # names and dates left as strings
+        if (
+            df is None
+            or df.columns.duplicated().any()
+            or (df.columns == "").any()
+            or df.dtypes.map(is_datetime64_any_dtype).any()
+        ):
+            buffer.seek(0)
+            df = pd.read_csv(buffer)
+    else:
+        df = pd.read_excel(buffer)
+    return downcast_dtypes(df)
+
+
+def dtype_kind(dtype) -> str:
+    """Assigns our variable category (Numeric, Categorical, Date) to a pandas dtype, extension dtypes included
+
+    Args:
+        dtype: dtype of a column
+
+    Returns:
+        str: "Numeric", "Categorical" or "Date"
+    """
+    if is_datetime64_any_dtype(dtype):
+        return "Date"
+    if is_numeric_dtype(dtype):
+        return "Numeric"
+    return "Categorical"
+
+
+def create_type_df(df: pd.DataFrame) -> pd.DataFrame:
     """Creates a dataframe that assigns our variable categories (Numeric, Categorical) to each variable in the dataframe
 
     Args:
         pd.DataFrame: dataframe of the data
-        dict: dictionary that assigns our categories to the possible dtypes
 
 
     Returns:
@@ -26,7 +116,7 @@ def create_type_df(df: pd.DataFrame, dtype_map: dict) -> pd.DataFrame:
     original_types = pd.DataFrame(
         {
             "Variable": df.columns.to_list(),
-            "Type": [dtype_map[a] for a in [str(typ) for typ in df.dtypes]],
+            "Type": df.dtypes.map(dtype_kind).to_list(),
         }
     )
     return original_types
@@ -41,10 +131,7 @@ def create_type_dict(type_df: pd.DataFrame) -> dict:
     Returns:
         dict: Keys are the variables in the data, values are their categories (Numeric, Categorical)
     """
-    type_dict = {}
-    for i in range(len(type_df)):
-        type_dict[type_df.iloc[i]["Variable"]] = type_df.iloc[i]["Type"]
-    return type_dict
+    return dict(zip(type_df["Variable"].values, type_df["Type"].values))
 
 
 def cast_dtype(
@@ -61,9 +148,13 @@ def cast_dtype(
     Returns:
         tuple: first element is the updated dataframe, second element is the new previous dictionary
     """
-    for key in res_dict.keys():
-        if res_dict[key] != orig_dict[key]:
-            df[key] = df[key].astype(dtype_map[res_dict[key]])
+    changed = {
+        key: value for key, value in res_dict.items() if orig_dict.get(key) != value
+    }
+    # One astype call per target type instead of one per column
+    for target_type in set(changed.values()):
+        cols = [key for key, value in changed.items() if value == target_type]
+        df[cols] = df[cols].astype(dtype_map[target_type])
     orig_dict = res_dict
     return df, orig_dict
 
@@ -72,25 +163,19 @@ def cast_dtype(
 
 
 @st.cache_data
-def find_cat_cols(df: pd.DataFrame, target_var: str, dtype_map: dict) -> tuple:
+def find_cat_cols(df: pd.DataFrame, target_var: str) -> tuple:
     """_summary_
 
     Args:
         df (pd.DataFrame): data
         target_var (str): y
-        dtype_map (dict): maps dtypes to our types (Numeric, Categorical)
 
     Returns:
         list: list of columns to encode (categorical and not target variables)
     """
-    valid_cols = [
-        col
-        for col in df.columns.to_list()
-        if (
-            (dtype_map[str(df[col].dtype)] == "Categorical") and (col not in target_var)
-        )
-    ]
-    return valid_cols
+    types = df.dtypes.map(dtype_kind)
+    valid_cols = types[(types == "Categorical") & (types.index != target_var)]
+    return valid_cols.index.to_list()
 
 
 def find_cont_cols(df,target_var):
@@ -107,117 +192,91 @@ def find_cont_cols(df,target_var):
 
 
 # TODO KILL?
-def find_label_type(df: pd.DataFrame, target_var: str, dtype_map: dict) -> str:
+def find_label_type(df: pd.DataFrame, target_var: str) -> str:
     """Returns "Numeric" or "Categorical" for the target variable. This is needed for the target encoding.
 
     Args:
         df (pd.DataFrame):
         target_var (str): y
-        dtype_map (dict): maps dtypes to our types (Numeric, Categorical)
 
     Returns:
         str: "Numeric" or "Categorical"
     """
-    y_type = dtype_map[str(df[target_var].dtype)]
+    y_type = dtype_kind(df[target_var].dtype)
     return y_type
 
 
 ############################### Encoding ##################################
-@st.cache_data
-def one_hot_encoding(df: pd.DataFrame, x_column: str) -> tuple:
-    """Encodes one column using onehot encoding
+def create_encoder(encoding_cols: dict, y_type: str) -> ColumnTransformer:
+    """Creates one transformer that encodes every categorical column according to its chosen encoding
 
     Args:
-        df (pd.DataFrame): data
-        x_column (str): column to encode
+        encoding_cols (dict): keys are the encoding types (One-Hot, Ordinal, Target), values are the columns to encode with them
+        y_type (str): y type (Numeric or Categorical)
 
     Returns:
-        tuple: first element is the encoded column (numpy array), second element is the encoded name
+        ColumnTransformer: unfitted encoder with pandas output, transformers are in One-Hot, Ordinal, Target order
     """
-    encoder = OneHotEncoder(drop="first", sparse_output=False, dtype=np.int8)
-    encoded_column = encoder.fit_transform(df[x_column].values.reshape(-1, 1))
-    encoded_column_name = [
-        x_column + "_one_hot_" + str(cat) for cat in encoder.categories_[0][1:]
-    ]
-    return encoded_column, encoded_column_name
+    transformers = []
+    if encoding_cols["One-Hot"]:
+        transformers.append(
+            (
+                "one_hot",
+                OneHotEncoder(drop="first", sparse_output=False, dtype=np.int8),
+                encoding_cols["One-Hot"],
+            )
+        )
+    if encoding_cols["Ordinal"]:
+        transformers.append(
+            (
+                "ordinal",
+                OrdinalEncoder(
+                    handle_unknown="use_encoded_value", unknown_value=np.nan
+                ),
+                encoding_cols["Ordinal"],
+            )
+        )
+    if encoding_cols["Target"]:
+        target_type = "continuous" if y_type == "Numeric" else "auto"
+        transformers.append(
+            (
+                "target",
+                TargetEncoder(smooth="auto", target_type=target_type),
+                encoding_cols["Target"],
+            )
+        )
+    return ColumnTransformer(transformers, n_jobs=-1).set_output(transform="pandas")
 
 
-@st.cache_data
-def tartet_encoding(
-    df: pd.DataFrame, x_column: str, target_column: str, coltype: str
-) -> tuple:
-    """Encodes one column using target encoding
+def create_encoded_names(encoder: ColumnTransformer, encoding_cols: dict) -> dict:
+    """Names the encoded columns: x_one_hot_category, x_ordinal, x_target (x_target_class in case of multiclass prediction)
 
     Args:
-        df (pd.DataFrame): data
-        x_column (str): variable to encode
-        target_column (str): y variable
-        coltype (str): y type (Numeric or Categorical)
+        encoder (ColumnTransformer): fitted encoder created by create_encoder
+        encoding_cols (dict): keys are the encoding types (One-Hot, Ordinal, Target), values are the columns to encode with them
 
     Returns:
-        tuple: first element is the encoded column (numpy array or multidimensional array in case of multiclass prediction), second element is the encoded name (or a list of them in case of multiclass prediction)
+        dict: keys are the encoded variables, values are the lists of their encoded names, both in the order of the encoder output
     """
-    x = df[x_column].to_numpy().reshape(-1, 1)
-    if coltype == "Numeric":
-        encoder = TargetEncoder(smooth="auto", target_type="continuous")
-        encoded_column = encoder.fit_transform(X=x, y=df[target_column])
-        encoded_column_name = x_column + "_target"
-    else:
-        encoder = TargetEncoder(smooth="auto", target_type="auto")
-        encoded_column = encoder.fit_transform(X=x, y=df[target_column])
-        if encoder.target_type_ == "binary":
-            encoded_column_name = x_column + "_target"
-        else:
-            encoded_column_name = [
-                x_column + "_target_" + str(cat) for cat in encoder.classes_
+    encoded_names = {}
+    if encoding_cols["One-Hot"]:
+        one_hot = encoder.named_transformers_["one_hot"]
+        for x_column, categories in zip(encoding_cols["One-Hot"], one_hot.categories_):
+            encoded_names[x_column] = [
+                x_column + "_one_hot_" + str(cat) for cat in categories[1:]
             ]
-
-    return encoded_column, encoded_column_name
-
-
-@st.cache_data
-def ordinal_encoding(df: pd.DataFrame, x_column: str) -> tuple:
-    """Encodes one column using ordinal encoding
-
-    Args:
-        df (pd.DataFrame): data
-        x_column (str): column to encode
-
-    Returns:
-        tuple: first element is the encoded column (numpy array), second element is the encoded name
-    """
-    oe = OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=np.nan)
-    encoded_column = oe.fit_transform(df[x_column].values.reshape(-1, 1))
-    encoded_column_name = x_column + "_ordinal"
-    return encoded_column, encoded_column_name
-
-
-@st.cache_data
-def create_encoded_column(
-    encoding: str, x_column: str, df: pd.DataFrame, target_column: str, y_type: str
-) -> tuple:
-    """Encodes the given column using according to the users chosen encoding
-
-    Args:
-        encoding (str): Encoding type (One-hot, Ordinal or Target)
-        x_column (str): Variable to encode
-        df (pd.DataFrame): data
-        target_column (str): y
-        y_type (str): y type (Numeric or Categorical)
-
-    Returns:
-        tuple: first element is the encoded column (pd.DataFrame), second element is the encoded variable name
-    """
-    if encoding == "One-Hot":
-        encoded_column, encoded_column_name = one_hot_encoding(df=df, x_column=x_column)
-    elif encoding == "Target":
-        encoded_column, encoded_column_name = tartet_encoding(
-            df, x_column, target_column, coltype=y_type
-        )
-    elif encoding == "Ordinal":
-        encoded_column, encoded_column_name = ordinal_encoding(df, x_column)
-
-    return pd.DataFrame(encoded_column), encoded_column_name
+    for x_column in encoding_cols["Ordinal"]:
+        encoded_names[x_column] = [x_column + "_ordinal"]
+    if encoding_cols["Target"]:
+        target = encoder.named_transformers_["target"]
+        for x_column in encoding_cols["Target"]:
+            if target.target_type_ == "multiclass":
+                encoded_names[x_column] = [
+                    x_column + "_target_" + str(cat) for cat in target.classes_
+                ]
+            else:
+                encoded_names[x_column] = [x_column + "_target"]
+    return encoded_names
 
 
 @st.cache_data
@@ -226,7 +285,6 @@ def create_cat_df(
     df: pd.DataFrame,
     target_var: str,
     y_type: str,
-    dtype_map: dict,
 ) -> pd.DataFrame:
     """Creates the encoded X (feature) DataFrame
 
@@ -235,40 +293,30 @@ def create_cat_df(
         df (pd.DataFrame): data
         target_var (str): y
         y_type (str): y type (Numeric, Categorical)
-        dtype_map (dict): maps dtypes to our types (Numeric, Categorical)
 
     Returns:
         pd.DataFrame: Encoded feature (X) DataFrame
     """
-    model_df = pd.DataFrame()
-    """model_df = pd.concat(
-        [
-            df[col]
-            for col in [
-                col1
-                for col1 in df.columns
-                if dtype_map[str(df[col1].dtype)] == "Numeric"
-            ]
-        ],
-        axis=1,
-    )"""
-    for _, row in res_df.iterrows():
-        encoded_col, encoded_colname = create_encoded_column(
-            encoding=row["Encoding"],
-            x_column=row["Variable"],
-            df=df,
-            target_column=target_var,
-            y_type=y_type,
-        )
-        if isinstance(encoded_colname, str):
-            encoded_col.columns = [encoded_colname]
-        else:
-            encoded_col.columns = encoded_colname
-
-        model_df = pd.concat([model_df, encoded_col], axis=1)
-    if target_var in model_df.columns:
-        model_df = model_df.drop(target_var, axis=1)
-    return model_df
+    encoding_cols = {
+        encoding: res_df.loc[res_df["Encoding"] == encoding, "Variable"].to_list()
+        for encoding in ("One-Hot", "Ordinal", "Target")
+    }
+    x_columns = [col for cols in encoding_cols.values() for col in cols]
+    if not x_columns:
+        return pd.DataFrame()
+
+    # All columns are encoded in a single fit, grouped by encoding type. The groups are
+    # fitted in parallel threads, so the data isn't copied to worker processes
+    encoder = create_encoder(encoding_cols, y_type)
+    with parallel_backend("threading"):
+        model_df = encoder.fit_transform(df[x_columns], df[target_var])
+    encoded_names = create_encoded_names(encoder, encoding_cols)
+    model_df.columns = [name for names in encoded_names.values() for name in names]
+    # Put the encoded columns back in the row order of the encoding table
+    model_df = model_df[
+        [name for x_column in res_df["Variable"] for name in encoded_names[x_column]]
+    ]
+    return model_df.drop(columns=[target_var], errors="ignore")
 
 
 ###################### Continous feature engineering ###############
@@ -276,7 +324,7 @@ def log_column(df, column):
     """
     Transform the given column to its logarithm.
     """
-    col = np.log(df[column])
+    col = np.log(df[column].astype(np.float64))
     return col
 
 
@@ -344,12 +392,47 @@ def filter_data(df, cols):
     return df[cols]
 
 
+def pca_input(df, sparse_input=False):
+    values = df.to_numpy(dtype=np.float64)
+    return sparse.csr_matrix(values) if sparse_input else values
+
+
+# Fitted once per feature set and shared by the scree plot and the projection,
+# so moving the number of components slider doesn't refit the PCA. Only the fitted
+# models are cached (the scaled data is recomputed when needed) and only for a few
+# feature sets, as this cache is shared by every session
+@st.cache_resource(max_entries=5)
+def fit_pca(df, max_components=100, max_density=0.1):
+    values = pca_input(df)
+    if min(df.shape) <= max_components:
+        scaler = StandardScaler().fit(values)
+        pca = PCA().fit(scaler.transform(values))
+        return scaler, pca
+
+    # On wide data only the leading components are kept
+    if np.count_nonzero(values) <= max_density * values.size:
+        # Mostly zeros (e.g. many one-hot columns): the data stays sparse, it is scaled
+        # without centering and the arpack solver centers it implicitly, which gives the
+        # same components as centering and scaling the dense data
+        values = sparse.csr_matrix(values)
+        scaler = StandardScaler(with_mean=False).fit(values)
+        pca = PCA(n_components=max_components, svd_solver="arpack", random_state=0)
+    else:
+        # Randomized SVD finds the leading components much faster than the full SVD
+        scaler = StandardScaler().fit(values)
+        pca = PCA(
+            n_components=max_components,
+            svd_solver="randomized",
+            iterated_power=5,
+            random_state=0,
+        )
+    pca.fit(scaler.transform(values))
+    return scaler, pca
+
+
 @st.cache_data
 def create_pca_before(df):
-    pipeline = Pipeline([("scaler", StandardScaler()), ("pca", PCA())])
-    pipeline.fit(df)
-
-    pca = pipeline.named_steps["pca"]
+    _, pca = fit_pca(df)
     explained_variance_ratio = pca.explained_variance_ratio_
     cumulative_explained_variance = explained_variance_ratio.cumsum()
     variance_df = pd.DataFrame(
@@ -366,10 +449,12 @@ def create_pca_before(df):
 
 @st.cache_data
 def create_pca_after(df, n_comp):
-    pipeline = Pipeline(
-        [("scaler", StandardScaler()), ("pca", PCA(n_components=n_comp))]
-    )
-    principal_components = pipeline.fit_transform(df)
+    scaler, pca = fit_pca(df)
+    # The scaler was fitted without centering exactly when the data was kept sparse
+    scaled = scaler.transform(pca_input(df, sparse_input=not scaler.with_mean))
+    components = pca.components_[:n_comp].T
+    # Centering after the projection works for sparse scaled data as well
+    principal_components = scaled @ components - pca.mean_ @ components
     principal_df = pd.DataFrame(
         data=principal_components, columns=[f"PC{i+1}" for i in range(n_comp)]
     )
@@ -378,38 +463,40 @@ def create_pca_after(df, n_comp):
 
 @st.cache_resource(experimental_allow_widgets=True)
 def create_pca_plots(df):
-    explained_variance_chart = (
-        alt.Chart(df)
-        .mark_line(point=True)
-        .encode(
-            x="Number of Principal Components",
-            y="Explained Variance Ratio",
-            tooltip=["Number of Principal Components", "Explained Variance Ratio"],
-        )
-        .properties(title="Explained Variance Ratio by Principal Components")
+    metrics = ["Explained Variance Ratio", "Cumulative Explained Variance"]
+    # Long format, so the data is sent to the browser once for both panels
+    long_df = df.melt(
+        id_vars="Number of Principal Components",
+        value_vars=metrics,
+        var_name="Metric",
+        value_name="Value",
     )
-
-    # Plotting the cumulative explained variance using Altair
-    cumulative_variance_chart = (
-        alt.Chart(df)
-        .mark_line(point=True, color="orange")
+    chart = (
+        alt.Chart(long_df)
+        .mark_line(point=True)
         .encode(
-            x="Number of Principal Components",
-            y="Cumulative Explained Variance",
-            tooltip=["Number of Principal Components", "Cumulative Explained Variance"],
+            x="Number of Principal Components:Q",
+            y="Value:Q",
+            color=alt.Color(
+                "Metric:N",
+                scale=alt.Scale(domain=metrics, range=["#4c78a8", "orange"]),
+                legend=None,
+            ),
+            tooltip=["Number of Principal Components", "Metric", "Value"],
         )
-        .properties(title="Cumulative Explained Variance by Principal Components")
+        .facet(column=alt.Column("Metric:N", sort=metrics, title=None))
+        .resolve_scale(y="independent")
     )
-
-    # Combine the two charts
-    combined_chart = alt.hconcat(explained_variance_chart, cumulative_variance_chart)
-    return combined_chart
+    return chart
 
 
 ############################# EDA ############################################
 @st.cache_data
 def cast_date_to_timestamp(df: pd.DataFrame):
-    for col in df.columns:
-        if df[col].dtype == "datetime64[ns]":
-            df[col] = df[col].astype("int64")
+    date_cols = df.columns[df.dtypes.map(is_datetime64_any_dtype).to_numpy()]
+    if len(date_cols) > 0:
+        # Always nanoseconds, whatever resolution the dates were parsed with
+        df[date_cols] = df[date_cols].apply(
+            lambda col: col.dt.as_unit("ns").astype("int64")
+        )
     return df
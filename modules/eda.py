@@ -50,7 +50,10 @@ def v_counts_bar_chart(df: pd.DataFrame, selected_cat: str) -> alt.Chart:
 def stacked_bar(df, chosen_features):
     fig = (
         alt.Chart(
-            sample_check(df).groupby(chosen_features).size().reset_index(name="Count")
+            sample_check(df)
+            .groupby(chosen_features, observed=True)
+            .size()
+            .reset_index(name="Count")
         )
         .mark_bar()
         .encode(
@@ -88,9 +91,9 @@ def scatter(df, chosen_features):
 
 @st.cache_resource(experimental_allow_widgets=True)
 def cor_matrix(df):
-    n = len(df.select_dtypes(include=["int64", "float64"]).columns)
+    n = len(df.select_dtypes(include="number").columns)
     df = (
-        df.select_dtypes(include=["int64", "float64"])
+        df.select_dtypes(include="number")
         .corr()
         .stack()
         .reset_index()
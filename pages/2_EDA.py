@@ -9,7 +9,7 @@ from modules.eda import (
     cor_matrix,
     missing_value_plot,
 )
-from modules.data_wrangling import cast_date_to_timestamp
+from modules.data_wrangling import cast_date_to_timestamp, dtype_kind
 
 
 st.set_page_config(page_title="Exploratory data analysis", layout="wide")
@@ -24,13 +24,6 @@ st.title("Exploratory data analysis")
 alt.data_transformers.disable_max_rows()
 st.session_state["df"] = cast_date_to_timestamp(st.session_state["df"])
 
-dtype_map_inverse = {
-    "float64": "Numeric",
-    "category": "Categorical",
-    "object": "Categorical",
-    "int64": "Numeric",
-}
-
 
 st.header("Descriptive Table")
 percentiles = st.multiselect(
@@ -51,7 +44,11 @@ if st.toggle(label="Create histogram", key="hist"):
 
 
 st.header("Value Counts Chart")
-cat_options = st.session_state["df"].select_dtypes(include="object").columns.tolist()
+cat_options = (
+    st.session_state["df"]
+    .select_dtypes(include=["object", "category"])
+    .columns.tolist()
+)
 selected_cat = st.selectbox("Select categorical variable", cat_options)
 if st.toggle(label="Create value counts chart", key="v_counts"):
     fig = v_counts_bar_chart(st.session_state["df"], selected_cat)
@@ -69,16 +66,16 @@ options = st.multiselect(
 if len(options) == 2 and st.toggle(label="Create association figure", key="ass"):
     # Both category:
     if (
-        dtype_map_inverse[str(st.session_state["df"][options[0]].dtype)]
-        == dtype_map_inverse[str(st.session_state["df"][options[1]].dtype)]
+        dtype_kind(st.session_state["df"][options[0]].dtype)
+        == dtype_kind(st.session_state["df"][options[1]].dtype)
         == "Categorical"
     ):
         st.write("Both Cat")
         fig = stacked_bar(st.session_state["df"], options)
     # Both continous:
     elif (
-        dtype_map_inverse[str(st.session_state["df"][options[0]].dtype)]
-        == dtype_map_inverse[str(st.session_state["df"][options[1]].dtype)]
+        dtype_kind(st.session_state["df"][options[0]].dtype)
+        == dtype_kind(st.session_state["df"][options[1]].dtype)
         == "Numeric"
     ):
         st.write("Both Cont")
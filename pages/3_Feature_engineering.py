@@ -13,15 +13,10 @@ from modules.data_wrangling import (
     find_cont_cols,
     create_cont_df,
     create_x_df,
+    cast_date_to_timestamp,
 )
 
 
-dtype_map_inverse = {
-    "float64": "Numeric",
-    "category": "Categorical",
-    "object": "Categorical",
-    "int64": "Numeric",
-}
 encodings = ("One-Hot", "Target", "Ordinal")
 
 
@@ -34,6 +29,8 @@ if "df" not in st.session_state:
 
 
 st.title("Feature Engineering")
+# Dates are used as numeric timestamp features, the same way the EDA page shows them
+st.session_state["df"] = cast_date_to_timestamp(st.session_state["df"])
 
 
 st.header("Choose target variable")
@@ -48,11 +45,9 @@ target_var = st.selectbox(
 st.session_state["y_colname"] = target_var
 
 # Encode target variable and specify problem type
-object_or_cat = pd.api.types.is_object_dtype(
-    st.session_state["df"][target_var]
-) or pd.api.types.is_categorical_dtype(st.session_state["df"][target_var])
+y_type = find_label_type(st.session_state["df"], target_var)
 
-if object_or_cat:
+if y_type == "Categorical":
     label_encoder = LabelEncoder()
     st.session_state["y"] = label_encoder.fit_transform(
         st.session_state["df"][target_var]
@@ -76,8 +71,7 @@ st.write(
 )
 
 
-cat_cols = find_cat_cols(st.session_state["df"], target_var, dtype_map_inverse)
-y_type = find_label_type(st.session_state["df"], target_var, dtype_map_inverse)
+cat_cols = find_cat_cols(st.session_state["df"], target_var)
 original_encodings = pd.DataFrame({"Variable": cat_cols, "Encoding": "One-Hot"})
 
 
@@ -101,9 +95,7 @@ response = AgGrid(
 )
 cat_res_df = response.data
 # Create X df
-cat_df = create_cat_df(
-    cat_res_df, st.session_state["df"], target_var, y_type, dtype_map_inverse
-)
+cat_df = create_cat_df(cat_res_df, st.session_state["df"], target_var, y_type)
 
 # Transform continous variables
 st.header("Transfrorm continous variables")